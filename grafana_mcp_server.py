@@ -3,55 +3,125 @@
 # Handles dashboards, annotations, alerts, and data sources
 
 import os
-import json
-import requests
-from typing import Any, Dict, List, Optional
+import orjson
+import asyncio
+import httpx
+from cachetools import TTLCache
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
 from mcp.server.fastmcp import FastMCP
 
 # Load environment
 GRAFANA_URL = os.getenv("GRAFANA_URL", "http://localhost:3000")
 GRAFANA_API_KEY = os.getenv("GRAFANA_API_KEY")  # Service account token
 GRAFANA_ORG_ID = int(os.getenv("GRAFANA_ORG_ID", "1"))
+GRAFANA_POOL_SIZE = int(os.getenv("GRAFANA_POOL_SIZE", "32"))
+GRAFANA_CONCURRENCY = int(os.getenv("GRAFANA_CONCURRENCY", "20"))  # Max in-flight fan-out requests
+GRAFANA_RETRIES = int(os.getenv("GRAFANA_RETRIES", "3"))
 
-mcp = FastMCP("grafana")
+# Transient statuses retried with backoff, for idempotent methods only
+_RETRY_STATUSES = {429, 502, 503, 504}
+_RETRY_METHODS = {"GET", "PUT", "DELETE"}
+_RETRY_BACKOFF = 0.2  # seconds, doubled per attempt
 
-def grafana_headers():
-    return {
-        "Authorization": f"Bearer {GRAFANA_API_KEY}",
-        "Content-Type": "application/json",
-        "X-Grafana-Org-Id": str(GRAFANA_ORG_ID)
-    }
+# Short-lived cache for read-only endpoints that rarely change
+GRAFANA_CACHE_TTL = int(os.getenv("GRAFANA_CACHE_TTL", "30"))  # seconds
+_response_cache: TTLCache = TTLCache(maxsize=256, ttl=GRAFANA_CACHE_TTL)
 
-def grafana_get(endpoint: str, params: Dict = None) -> Dict[str, Any]:
-    """GET request to Grafana API"""
-    resp = requests.get(f"{GRAFANA_URL}/api{endpoint}", headers=grafana_headers(), params=params)
+_GRAFANA_HEADERS = {
+    "Authorization": f"Bearer {GRAFANA_API_KEY}",
+    "Content-Type": "application/json",
+    "X-Grafana-Org-Id": str(GRAFANA_ORG_ID)
+}
+
+@asynccontextmanager
+async def startup(server: FastMCP) -> AsyncIterator[httpx.AsyncClient]:
+    """Open a pooled Grafana client for the lifetime of one server session"""
+    async with httpx.AsyncClient(
+        base_url=f"{GRAFANA_URL}/api",
+        headers=_GRAFANA_HEADERS,
+        timeout=30.0,
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=GRAFANA_RETRIES,  # Connection failures only
+            limits=httpx.Limits(
+                max_connections=GRAFANA_POOL_SIZE,
+                max_keepalive_connections=GRAFANA_POOL_SIZE
+            )
+        )
+    ) as client:
+        yield client
+
+mcp = FastMCP("grafana", lifespan=startup)
+
+def grafana_client() -> httpx.AsyncClient:
+    """Pooled client opened by the lifespan of the session handling this request"""
+    return mcp.get_context().request_context.lifespan_context
+
+def _dumps(data: Any) -> Optional[bytes]:
+    return orjson.dumps(data) if data is not None else None
+
+async def grafana_request(method: str, endpoint: str, **kwargs) -> httpx.Response:
+    """Send a request over the pooled client, retrying transient failures"""
+    attempts = GRAFANA_RETRIES + 1 if method in _RETRY_METHODS else 1
+    for attempt in range(attempts):
+        resp = await grafana_client().request(method, endpoint, **kwargs)
+        if resp.status_code not in _RETRY_STATUSES or attempt == attempts - 1:
+            break
+        await asyncio.sleep(_RETRY_BACKOFF * (2 ** attempt))
     resp.raise_for_status()
-    return resp.json()
+    return resp
 
-def grafana_post(endpoint: str, data: Dict = None) -> Dict[str, Any]:
+async def grafana_get(endpoint: str, params: Dict = None) -> Dict[str, Any]:
+    """GET request to Grafana API"""
+    resp = await grafana_request("GET", endpoint, params=params)
+    return orjson.loads(resp.content)
+
+def _cache_key(endpoint: str, params: Dict = None) -> tuple:
+    if not params:
+        return (endpoint, None)
+    return (endpoint, tuple(sorted(
+        (k, tuple(v) if isinstance(v, list) else v) for k, v in params.items()
+    )))
+
+async def grafana_get_cached(endpoint: str, params: Dict = None) -> Dict[str, Any]:
+    """GET request to a read-only Grafana endpoint, cached for GRAFANA_CACHE_TTL"""
+    key = _cache_key(endpoint, params)
+    try:
+        return _response_cache[key]
+    except KeyError:
+        pass
+    result = await grafana_get(endpoint, params)
+    _response_cache[key] = result
+    return result
+
+def grafana_invalidate(endpoint: str, params: Dict = None):
+    """Drop a cached response after the underlying resource changes"""
+    _response_cache.pop(_cache_key(endpoint, params), None)
+
+async def grafana_post(endpoint: str, data: Dict = None) -> Dict[str, Any]:
     """POST request to Grafana API"""
-    resp = requests.post(f"{GRAFANA_URL}/api{endpoint}", headers=grafana_headers(), json=data)
-    resp.raise_for_status()
-    return resp.json()
+    resp = await grafana_request("POST", endpoint, content=_dumps(data))
+    return orjson.loads(resp.content)
 
-def grafana_put(endpoint: str, data: Dict = None) -> Dict[str, Any]:
+async def grafana_put(endpoint: str, data: Dict = None) -> Dict[str, Any]:
     """PUT request to Grafana API"""
-    resp = requests.put(f"{GRAFANA_URL}/api{endpoint}", headers=grafana_headers(), json=data)
-    resp.raise_for_status()
-    return resp.json()
+    resp = await grafana_request("PUT", endpoint, content=_dumps(data))
+    return orjson.loads(resp.content)
 
-def grafana_delete(endpoint: str) -> Dict[str, Any]:
+async def grafana_delete(endpoint: str) -> Dict[str, Any]:
     """DELETE request to Grafana API"""
-    resp = requests.delete(f"{GRAFANA_URL}/api{endpoint}", headers=grafana_headers())
-    resp.raise_for_status()
-    return resp.json() if resp.text else {"status": "deleted"}
+    resp = await grafana_request("DELETE", endpoint)
+    return orjson.loads(resp.content) if resp.content else {"status": "deleted"}
 
 # ========= Health Check =========
 @mcp.resource("grafana://health")
 async def grafana_health() -> Dict[str, Any]:
     try:
-        health = grafana_get("/health")
-        org = grafana_get(f"/orgs/{GRAFANA_ORG_ID}")
+        health, org = await asyncio.gather(
+            grafana_get_cached("/health"),
+            grafana_get_cached(f"/orgs/{GRAFANA_ORG_ID}")
+        )
         return {
             "ok": True,
             "grafana_url": GRAFANA_URL,
@@ -66,72 +136,74 @@ async def grafana_health() -> Dict[str, Any]:
 @mcp.resource("grafana://dashboards")
 async def list_dashboards() -> List[Dict[str, Any]]:
     """List all dashboards"""
-    search_results = grafana_get("/search", {"type": "dash-db"})
+    search_results = await grafana_get("/search", {"type": "dash-db"})
     return search_results
 
 @mcp.resource("grafana://dashboard/{uid}")
 async def get_dashboard(uid: str) -> Dict[str, Any]:
     """Get dashboard by UID"""
-    return grafana_get(f"/dashboards/uid/{uid}")
+    return await grafana_get(f"/dashboards/uid/{uid}")
+
+# Built once at import; the dashboard definition never changes between calls
+_UNIFI_DASHBOARD_BYTES = orjson.dumps({
+    "dashboard": {
+        "title": "UniFi Network Monitor",
+        "tags": ["unifi", "network", "monitoring"],
+        "timezone": "browser",
+        "panels": [
+            {
+                "id": 1,
+                "title": "Client Connections",
+                "type": "stat",
+                "targets": [
+                    {
+                        "expr": "sum(unifi_event{event_type=\"client_connect\"})",
+                        "legendFormat": "Active Connections"
+                    }
+                ],
+                "gridPos": {"h": 8, "w": 12, "x": 0, "y": 0}
+            },
+            {
+                "id": 2,
+                "title": "Access Events",
+                "type": "timeseries",
+                "targets": [
+                    {
+                        "expr": "rate(unifi_event{source=\"access\"}[5m])",
+                        "legendFormat": "{{event_type}}"
+                    }
+                ],
+                "gridPos": {"h": 8, "w": 12, "x": 12, "y": 0}
+            },
+            {
+                "id": 3,
+                "title": "Camera Events",
+                "type": "timeseries",
+                "targets": [
+                    {
+                        "expr": "rate(unifi_event{source=\"protect\"}[5m])",
+                        "legendFormat": "{{event_type}}"
+                    }
+                ],
+                "gridPos": {"h": 8, "w": 24, "x": 0, "y": 8}
+            }
+        ],
+        "time": {"from": "now-1h", "to": "now"},
+        "refresh": "30s"
+    },
+    "overwrite": True
+})
 
 @mcp.tool()
-def create_unifi_dashboard() -> Dict[str, Any]:
+async def create_unifi_dashboard() -> Dict[str, Any]:
     """Create a UniFi monitoring dashboard"""
-    dashboard = {
-        "dashboard": {
-            "title": "UniFi Network Monitor",
-            "tags": ["unifi", "network", "monitoring"],
-            "timezone": "browser",
-            "panels": [
-                {
-                    "id": 1,
-                    "title": "Client Connections",
-                    "type": "stat",
-                    "targets": [
-                        {
-                            "expr": "sum(unifi_event{event_type=\"client_connect\"})",
-                            "legendFormat": "Active Connections"
-                        }
-                    ],
-                    "gridPos": {"h": 8, "w": 12, "x": 0, "y": 0}
-                },
-                {
-                    "id": 2,
-                    "title": "Access Events",
-                    "type": "timeseries",
-                    "targets": [
-                        {
-                            "expr": "rate(unifi_event{source=\"access\"}[5m])",
-                            "legendFormat": "{{event_type}}"
-                        }
-                    ],
-                    "gridPos": {"h": 8, "w": 12, "x": 12, "y": 0}
-                },
-                {
-                    "id": 3,
-                    "title": "Camera Events",
-                    "type": "timeseries",
-                    "targets": [
-                        {
-                            "expr": "rate(unifi_event{source=\"protect\"}[5m])",
-                            "legendFormat": "{{event_type}}"
-                        }
-                    ],
-                    "gridPos": {"h": 8, "w": 24, "x": 0, "y": 8}
-                }
-            ],
-            "time": {"from": "now-1h", "to": "now"},
-            "refresh": "30s"
-        },
-        "overwrite": True
-    }
-    
-    return grafana_post("/dashboards/db", dashboard)
+    resp = await grafana_request("POST", "/dashboards/db", content=_UNIFI_DASHBOARD_BYTES)
+    return orjson.loads(resp.content)
 
 @mcp.tool()
-def update_dashboard(uid: str, title: str = None, panels: List[Dict] = None) -> Dict[str, Any]:
+async def update_dashboard(uid: str, title: str = None, panels: List[Dict] = None) -> Dict[str, Any]:
     """Update an existing dashboard"""
-    current = grafana_get(f"/dashboards/uid/{uid}")
+    current = await grafana_get(f"/dashboards/uid/{uid}")
     dashboard = current["dashboard"]
     
     if title:
@@ -140,16 +212,16 @@ def update_dashboard(uid: str, title: str = None, panels: List[Dict] = None) ->
         dashboard["panels"] = panels
     
     payload = {"dashboard": dashboard, "overwrite": True}
-    return grafana_post("/dashboards/db", payload)
+    return await grafana_post("/dashboards/db", payload)
 
 # ========= Annotations =========
 @mcp.resource("grafana://annotations")
 async def list_annotations(limit: int = 100) -> List[Dict[str, Any]]:
     """List recent annotations"""
-    return grafana_get("/annotations", {"limit": limit})
+    return await grafana_get("/annotations", {"limit": limit})
 
 @mcp.tool()
-def create_annotation(text: str, tags: List[str] = None, time: int = None) -> Dict[str, Any]:
+async def create_annotation(text: str, tags: List[str] = None, time: int = None) -> Dict[str, Any]:
     """Create a new annotation"""
     import time as time_module
     
@@ -159,18 +231,28 @@ def create_annotation(text: str, tags: List[str] = None, time: int = None) -> Di
         "time": time or int(time_module.time() * 1000)
     }
     
-    return grafana_post("/annotations", annotation)
+    return await grafana_post("/annotations", annotation)
 
 @mcp.tool()
-def create_bulk_annotations(annotations: List[Dict[str, Any]]) -> Dict[str, Any]:
+async def create_bulk_annotations(annotations: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Create multiple annotations at once"""
+    semaphore = asyncio.Semaphore(GRAFANA_CONCURRENCY)
+
+    async def post(annotation: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            return await grafana_post("/annotations", annotation)
+
+    responses = await asyncio.gather(
+        *(post(annotation) for annotation in annotations),
+        return_exceptions=True
+    )
+
     results = []
-    for annotation in annotations:
-        try:
-            result = grafana_post("/annotations", annotation)
+    for result in responses:
+        if isinstance(result, Exception):
+            results.append({"success": False, "error": str(result)})
+        else:
             results.append({"success": True, "id": result.get("id")})
-        except Exception as e:
-            results.append({"success": False, "error": str(e)})
     
     return {
         "total": len(annotations),
@@ -183,10 +265,10 @@ def create_bulk_annotations(annotations: List[Dict[str, Any]]) -> Dict[str, Any]
 @mcp.resource("grafana://datasources")
 async def list_datasources() -> List[Dict[str, Any]]:
     """List all data sources"""
-    return grafana_get("/datasources")
+    return await grafana_get_cached("/datasources")
 
 @mcp.tool()
-def create_prometheus_datasource(name: str, url: str, default: bool = False) -> Dict[str, Any]:
+async def create_prometheus_datasource(name: str, url: str, default: bool = False) -> Dict[str, Any]:
     """Create a Prometheus data source"""
     datasource = {
         "name": name,
@@ -199,24 +281,24 @@ def create_prometheus_datasource(name: str, url: str, default: bool = False) ->
         }
     }
     
-    return grafana_post("/datasources", datasource)
+    result = await grafana_post("/datasources", datasource)
+    grafana_invalidate("/datasources")
+    return result
 
 # ========= Alerts =========
 @mcp.resource("grafana://alerts")
 async def list_alert_rules() -> List[Dict[str, Any]]:
     """List all alert rules"""
-    return grafana_get("/ruler/grafana/api/v1/rules")
+    return await grafana_get("/ruler/grafana/api/v1/rules")
 
-@mcp.tool()
-def create_unifi_alert_rule(
+def build_unifi_alert_rule(
     rule_name: str,
     condition: str,
     threshold: float,
     for_duration: str = "5m"
 ) -> Dict[str, Any]:
-    """Create alert rule for UniFi events"""
-    
-    rule = {
+    """Build a Grafana-managed alert rule definition for UniFi events"""
+    return {
         "uid": f"unifi_{rule_name.lower().replace(' ', '_')}",
         "title": rule_name,
         "condition": "B",
@@ -277,30 +359,43 @@ def create_unifi_alert_rule(
             "source": "unifi"
         }
     }
-    
-    return grafana_post("/ruler/grafana/api/v1/rules/unifi", {
+
+async def post_unifi_rule_group(rules: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Write the "unifi" rule group; Grafana replaces the whole group on each POST"""
+    return await grafana_post("/ruler/grafana/api/v1/rules/unifi", {
         "name": "unifi",
-        "rules": [rule]
+        "rules": rules
     })
 
+@mcp.tool()
+async def create_unifi_alert_rule(
+    rule_name: str,
+    condition: str,
+    threshold: float,
+    for_duration: str = "5m"
+) -> Dict[str, Any]:
+    """Create alert rule for UniFi events"""
+    rule = build_unifi_alert_rule(rule_name, condition, threshold, for_duration)
+    return await post_unifi_rule_group([rule])
+
 # ========= Search & Query =========
 @mcp.tool()
-def search_grafana(query: str, tags: List[str] = None) -> List[Dict[str, Any]]:
+async def search_grafana(query: str, tags: List[str] = None) -> List[Dict[str, Any]]:
     """Search dashboards, folders, and alerts"""
     params = {"q": query}
     if tags:
         params["tag"] = tags
     
-    return grafana_get("/search", params)
+    return await grafana_get("/search", params)
 
 @mcp.resource("grafana://folders")
 async def list_folders() -> List[Dict[str, Any]]:
     """List all folders"""
-    return grafana_get("/folders")
+    return await grafana_get_cached("/folders")
 
 # ========= Real-time Event Handler =========
 @mcp.tool()
-def handle_unifi_events(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+async def handle_unifi_events(events: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Handle incoming UniFi events and create appropriate Grafana artifacts"""
     
     # Create annotations for all events
@@ -325,7 +420,7 @@ def handle_unifi_events(events: List[Dict[str, Any]]) -> Dict[str, Any]:
             alert_worthy_events.append(event)
     
     # Bulk create annotations
-    annotation_result = create_bulk_annotations(annotations)
+    annotation_result = await create_bulk_annotations(annotations)
     
     # Handle alerts (could trigger notifications, update dashboards, etc.)
     alert_results = []
@@ -345,41 +440,42 @@ def handle_unifi_events(events: List[Dict[str, Any]]) -> Dict[str, Any]:
     }
 
 # ========= Setup Helper =========
+_UNIFI_ALERT_RULES = (
+    ("UniFi Access Denied", "rate(unifi_event{event_type=\"access_denied\"}[5m])", 0.1),
+    ("UniFi Camera Offline", "rate(unifi_event{event_type=\"camera_offline\"}[5m])", 0.05),
+    ("UniFi High Client Connections", "sum(unifi_event{event_type=\"client_connect\"})", 50)
+)
+
 @mcp.tool()
-def setup_unifi_monitoring() -> Dict[str, Any]:
+async def setup_unifi_monitoring() -> Dict[str, Any]:
     """One-click setup for UniFi monitoring in Grafana"""
     results = {}
     
     try:
         # 1. Create Prometheus datasource (if not exists)
-        existing_ds = grafana_get("/datasources")
+        existing_ds = await grafana_get_cached("/datasources")
         prometheus_exists = any(ds.get("type") == "prometheus" for ds in existing_ds)
         
         if not prometheus_exists:
             prometheus_url = os.getenv("PROMETHEUS_URL", "http://localhost:9090")
-            ds_result = create_prometheus_datasource("Prometheus", prometheus_url, True)
+            ds_result = await create_prometheus_datasource("Prometheus", prometheus_url, True)
             results["datasource"] = ds_result
         else:
             results["datasource"] = "Already exists"
         
         # 2. Create UniFi dashboard
-        dashboard_result = create_unifi_dashboard()
+        dashboard_result = await create_unifi_dashboard()
         results["dashboard"] = dashboard_result
         
-        # 3. Create basic alert rules
-        alert_rules = [
-            ("UniFi Access Denied", "rate(unifi_event{event_type=\"access_denied\"}[5m])", 0.1),
-            ("UniFi Camera Offline", "rate(unifi_event{event_type=\"camera_offline\"}[5m])", 0.05),
-            ("UniFi High Client Connections", "sum(unifi_event{event_type=\"client_connect\"})", 50)
-        ]
-        
-        alert_results = []
-        for name, condition, threshold in alert_rules:
-            try:
-                alert_result = create_unifi_alert_rule(name, condition, threshold)
-                alert_results.append({"name": name, "status": "created"})
-            except Exception as e:
-                alert_results.append({"name": name, "status": "failed", "error": str(e)})
+        # 3. Create basic alert rules (one write, since a POST replaces the whole group)
+        rules = [build_unifi_alert_rule(*rule) for rule in _UNIFI_ALERT_RULES]
+        try:
+            await post_unifi_rule_group(rules)
+            alert_results = [{"name": name, "status": "created"} for name, _, _ in _UNIFI_ALERT_RULES]
+        except Exception as e:
+            alert_results = [
+                {"name": name, "status": "failed", "error": str(e)} for name, _, _ in _UNIFI_ALERT_RULES
+            ]
         
         results["alerts"] = alert_results
         
@@ -404,3 +500,4 @@ def setup_unifi_grafana():
     }
 
 if __name__ == "__main__":
+    mcp.run()
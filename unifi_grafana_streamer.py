@@ -3,32 +3,51 @@
 # Polls UniFi events and pushes alerts/metrics to Grafana
 
 import asyncio
-import json
+import logging
+import logging.handlers
+import orjson
+import queue
+import re
+import ssl
 import time
+import zlib
 from datetime import datetime, timezone
-from typing import Dict, List, Any, Optional, Set
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Any, Optional
 from dataclasses import dataclass, asdict
 import httpx
+import ijson
 import os
+import websockets
+from cachetools import TTLCache
 from pathlib import Path
 
+log = logging.getLogger("unifi_grafana_streamer")
+
+# KEY=value lines from secrets.env: optional "export", single/double quoted
+# values, and trailing " # comments" (a '#' inside an unquoted value is kept)
+_ENV_RE = re.compile(
+    r"""^[ \t]*(?:export[ \t]+)?([A-Za-z_][A-Za-z0-9_]*)[ \t]*=[ \t]*"""
+    r"""(?:"((?:[^"\\\n]|\\.)*)"|'([^'\n]*)'|([^\n]*?))[ \t\r]*(?:[ \t]#[^\n]*)?$""",
+    re.MULTILINE
+)
+_ENV_ESCAPE_RE = re.compile(r'\\(["\\])')
+
 # Load secrets.env (reuse from main.py)
 def load_env_file(env_file: str = "secrets.env"):
     env_path = Path(env_file)
     if env_path.exists():
-        with open(env_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                if '=' in line:
-                    key, value = line.split('=', 1)
-                    key, value = key.strip(), value.strip()
-                    if (value.startswith('"') and value.endswith('"')) or \
-                       (value.startswith("'") and value.endswith("'")):
-                        value = value[1:-1]
-                    if key not in os.environ:
-                        os.environ[key] = value
+        with open(env_path, 'rb') as f:
+            text = f.read().decode('utf-8', 'replace')
+        for match in _ENV_RE.finditer(text):
+            key, double_quoted, single_quoted, bare = match.groups()
+            if double_quoted is not None:
+                value = _ENV_ESCAPE_RE.sub(r'\1', double_quoted)
+            elif single_quoted is not None:
+                value = single_quoted
+            else:
+                value = bare
+            os.environ.setdefault(key, value)
 
 load_env_file()
 
@@ -42,6 +61,11 @@ VERIFY_TLS = os.getenv("UNIFI_VERIFY_TLS", "false").lower() in ("1", "true", "ye
 GRAFANA_URL = os.getenv("GRAFANA_URL", "http://localhost:3000")
 GRAFANA_API_KEY = os.getenv("GRAFANA_API_KEY")  # Service account token
 
+_GRAFANA_HEADERS = {
+    "Authorization": f"Bearer {GRAFANA_API_KEY}",
+    "Content-Type": "application/json"
+}
+
 # MCP Grafana server (if using MCP instead of direct API)
 GRAFANA_MCP_ENDPOINT = os.getenv("GRAFANA_MCP_ENDPOINT", "http://localhost:8080")
 
@@ -49,10 +73,77 @@ GRAFANA_MCP_ENDPOINT = os.getenv("GRAFANA_MCP_ENDPOINT", "http://localhost:8080"
 EVENT_POLL_INTERVAL = int(os.getenv("EVENT_POLL_INTERVAL", "30"))  # seconds
 METRICS_PUSH_INTERVAL = int(os.getenv("METRICS_PUSH_INTERVAL", "60"))  # seconds
 
+# Event de-duplication cache (entries expire after DEDUP_TTL seconds)
+DEDUP_MAX = int(os.getenv("DEDUP_MAX", "20000"))
+DEDUP_TTL = int(os.getenv("DEDUP_TTL", "7200"))  # seconds
+
+# Max annotation POSTs in flight to Grafana at once
+ANNOTATION_CONCURRENCY = int(os.getenv("ANNOTATION_CONCURRENCY", "20"))
+
 # UniFi API endpoints
 NET_BASE = f"https://{UNIFI_HOST}:{UNIFI_PORT}/proxy/network/integrations/v1"
 ACCESS_BASE = f"https://{UNIFI_HOST}:{UNIFI_PORT}/proxy/access/api/v1"
 PROTECT_BASE = f"https://{UNIFI_HOST}:{UNIFI_PORT}/proxy/protect/api"
+PROTECT_WS_URL = f"wss://{UNIFI_HOST}:{UNIFI_PORT}/proxy/protect/ws/updates"
+
+# Receive Protect events over its updates WebSocket instead of polling
+PROTECT_WEBSOCKET = os.getenv("UNIFI_PROTECT_WEBSOCKET", "true").lower() in ("1", "true", "yes")
+
+# Queued events are flushed once a batch fills or has waited this long
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "100"))
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "1.0"))  # seconds
+
+# Protect /events responses larger than this are parsed incrementally
+PROTECT_STREAM_MIN_BYTES = 1024 * 1024
+
+def _ws_ssl_context() -> ssl.SSLContext:
+    ctx = ssl.create_default_context()
+    if not VERIFY_TLS:
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+def _decode_protect_packet(data: bytes) -> tuple:
+    """Split a binary Protect update packet into its (action, payload) frames.
+
+    Each frame is an 8-byte header (packet type, payload format, deflated
+    flag, reserved, big-endian uint32 size) followed by the payload.
+    """
+    frames = []
+    offset = 0
+    for _ in range(2):
+        payload_format, deflated = data[offset + 1], data[offset + 2]
+        size = int.from_bytes(data[offset + 4:offset + 8], "big")
+        body = data[offset + 8:offset + 8 + size]
+        if deflated:
+            body = zlib.decompress(body)
+        frames.append(orjson.loads(body) if payload_format == 1 else body)
+        offset += 8 + size
+    return frames[0], frames[1]
+
+class _AsyncByteReader:
+    """Async file-like view of an httpx byte stream, as consumed by ijson"""
+
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b""
+
+    async def first_byte(self) -> bytes:
+        """Buffer up to and return the first non-whitespace byte"""
+        while not self._buffer.lstrip():
+            chunk = await anext(self._chunks, b"")
+            if not chunk:
+                return b""
+            self._buffer += chunk
+        return self._buffer.lstrip()[:1]
+
+    async def read(self, size: int = -1) -> bytes:
+        if not self._buffer:
+            self._buffer = await anext(self._chunks, b"")
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
 
 @dataclass
 class UniFiEvent:
@@ -66,35 +157,58 @@ class UniFiEvent:
     message: str = ""
     metadata: Dict[str, Any] = None
 
+    # Prometheus exposition lines, filled from the instance __dict__
+    _TEMPLATE_WITH_DEV = (
+        'unifi_event{{source="{source}",event_type="{event_type}",site_id="{site_id}",'
+        'severity="{severity}",device_id="{device_id}"}} 1 {_ts_ms}\n'
+    )
+    _TEMPLATE_NO_DEV = (
+        'unifi_event{{source="{source}",event_type="{event_type}",site_id="{site_id}",'
+        'severity="{severity}"}} 1 {_ts_ms}\n'
+    )
+
+    def __post_init__(self):
+        # Parsed once so every sink reuses the same epoch-ms timestamp
+        self._ts_ms = int(datetime.fromisoformat(self.timestamp.replace('Z', '+00:00')).timestamp() * 1000)
+
     def to_grafana_annotation(self) -> Dict[str, Any]:
         """Convert to Grafana annotation format"""
         return {
-            "time": int(datetime.fromisoformat(self.timestamp.replace('Z', '+00:00')).timestamp() * 1000),
+            "time": self._ts_ms,
             "text": f"[{self.source.upper()}] {self.message}",
             "tags": [self.event_type, self.source, self.severity],
             "title": f"{self.event_type.title()} Event"
         }
 
     def to_prometheus_metric(self) -> str:
-        """Convert to Prometheus exposition format"""
-        labels = [
-            f'source="{self.source}"',
-            f'event_type="{self.event_type}"',
-            f'site_id="{self.site_id}"',
-            f'severity="{self.severity}"'
-        ]
-        if self.device_id:
-            labels.append(f'device_id="{self.device_id}"')
-        
-        timestamp_ms = int(datetime.fromisoformat(self.timestamp.replace('Z', '+00:00')).timestamp() * 1000)
-        
-        return f'unifi_event{{{"".join(labels)}}} 1 {timestamp_ms}'
+        """Convert to a newline-terminated Prometheus exposition line"""
+        template = self._TEMPLATE_WITH_DEV if self.device_id else self._TEMPLATE_NO_DEV
+        return template.format_map(self.__dict__)
+
+    def _prom_bytes(self) -> bytes:
+        return self.to_prometheus_metric().encode()
 
 class UniFiEventStreamer:
     def __init__(self):
-        self.http_client = httpx.AsyncClient(verify=VERIFY_TLS, timeout=30.0)
-        self.seen_events: Set[str] = set()
+        # HTTP/2 lets concurrent annotation POSTs share one multiplexed connection
+        self.http_client = httpx.AsyncClient(
+            verify=VERIFY_TLS,
+            http2=True,
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=64, max_connections=128)
+        )
+        # Keyed by hash of (source, identifying fields) to keep entries small
+        self.seen_events: TTLCache = TTLCache(maxsize=DEDUP_MAX, ttl=DEDUP_TTL)
         self.last_poll_time = datetime.now(timezone.utc)
+        # Pollers and the Protect WebSocket feed this queue; poll_and_stream drains it
+        self.event_queue: asyncio.Queue = asyncio.Queue()
+        # Protect is polled incrementally from the newest event start seen so far
+        self._last_protect_ts = int(self.last_poll_time.timestamp() * 1000) - 60_000
+        # Access has no time filter, so remember the previous response window and
+        # only treat events outside it as new (independent of the dedup TTL)
+        self._access_window_ids: set = set()
+        # Per endpoint: (URL + query, ETag, Last-Modified) of the last 200 response
+        self._validators: Dict[str, tuple] = {}
         
         self.headers = {
             "X-API-Key": UNIFI_API_KEY,
@@ -107,6 +221,40 @@ class UniFiEventStreamer:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self.http_client.aclose()
 
+    @asynccontextmanager
+    async def _conditional_stream(
+        self, url: str, params: Dict[str, Any] = None
+    ) -> AsyncIterator[Optional[httpx.Response]]:
+        """Streaming GET that revalidates against the last ETag/Last-Modified; None on 304"""
+        # Validators only apply to the exact query they were issued for; the
+        # time-windowed Protect query never matches, so it is fetched unconditionally
+        key = str(httpx.URL(url, params=params))
+        headers = self.headers
+        cached_key, etag, last_modified = self._validators.get(url, (None, None, None))
+        if cached_key == key and (etag or last_modified):
+            headers = dict(self.headers)
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        
+        async with self.http_client.stream("GET", url, headers=headers, params=params) as resp:
+            if resp.status_code == 304:
+                yield None
+                return
+            resp.raise_for_status()
+            
+            # One entry per endpoint, replaced on every poll, so this never grows
+            self._validators[url] = (key, resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+            yield resp
+
+    async def _conditional_get(self, url: str, params: Dict[str, Any] = None) -> Optional[httpx.Response]:
+        """GET that revalidates against the last ETag/Last-Modified; None on 304"""
+        async with self._conditional_stream(url, params) as resp:
+            if resp is not None:
+                await resp.aread()
+            return resp
+
     async def get_network_events(self) -> List[UniFiEvent]:
         """Poll Network/Integration API for client events"""
         events = []
@@ -116,24 +264,27 @@ class UniFiEventStreamer:
                 f"{NET_BASE}/sites", headers=self.headers
             )
             sites_resp.raise_for_status()
-            sites = sites_resp.json().get("data", [])
+            sites = orjson.loads(sites_resp.content).get("data", [])
             
-            for site in sites:
-                site_id = site.get("name", "default")
-                
-                # Get active clients to detect new connections
-                clients_resp = await self.http_client.get(
+            site_ids = [site.get("name", "default") for site in sites]
+            
+            # Get active clients for every site concurrently to detect new connections
+            client_responses = await asyncio.gather(*(
+                self.http_client.get(
                     f"{NET_BASE}/sites/{site_id}/clients/active", 
                     headers=self.headers
-                )
+                ) for site_id in site_ids
+            ))
+            
+            for site_id, clients_resp in zip(site_ids, client_responses):
                 clients_resp.raise_for_status()
-                clients = clients_resp.json().get("data", [])
+                clients = orjson.loads(clients_resp.content).get("data", [])
                 
                 for client in clients:
                     # Check if this is a new connection (simplified logic)
-                    event_id = f"network_connect_{client.get('mac')}_{client.get('last_seen')}"
+                    event_id = hash(("network", site_id, client.get("mac"), client.get("last_seen")))
                     if event_id not in self.seen_events:
-                        self.seen_events.add(event_id)
+                        self.seen_events[event_id] = 1
                         
                         events.append(UniFiEvent(
                             timestamp=datetime.now(timezone.utc).isoformat(),
@@ -147,7 +298,7 @@ class UniFiEventStreamer:
                         ))
                         
         except Exception as e:
-            print(f"Error polling network events: {e}")
+            log.error("Error polling network events: %s", e)
             
         return events
 
@@ -155,18 +306,22 @@ class UniFiEventStreamer:
         """Poll Access API for door/reader events"""
         events = []
         try:
-            resp = await self.http_client.get(
+            resp = await self._conditional_get(
                 f"{ACCESS_BASE}/events",
-                headers=self.headers,
                 params={"limit": 50, "sort": "-timestamp"}
             )
-            resp.raise_for_status()
-            access_events = resp.json().get("data", [])
+            if resp is None:  # Not modified since last poll
+                return events
+            access_events = orjson.loads(resp.content).get("data", [])
+            previous_window = self._access_window_ids
+            self._access_window_ids = {event.get("id") for event in access_events}
             
             for event in access_events:
-                event_id = f"access_{event.get('id')}"
+                if event.get("id") in previous_window:
+                    continue
+                event_id = hash(("access", event.get("id")))
                 if event_id not in self.seen_events:
-                    self.seen_events.add(event_id)
+                    self.seen_events[event_id] = 1
                     
                     severity = "warning" if event.get("access_granted") is False else "info"
                     
@@ -182,77 +337,124 @@ class UniFiEventStreamer:
                     ))
                     
         except Exception as e:
-            print(f"Error polling access events: {e}")
+            log.error("Error polling access events: %s", e)
             
         return events
 
+    def _protect_event(self, event: Dict[str, Any]) -> Optional[UniFiEvent]:
+        """Convert a raw Protect event, or None if it was already seen"""
+        event_id = hash(("protect", event.get("id")))
+        if event_id in self.seen_events:
+            return None
+        self.seen_events[event_id] = 1
+        
+        severity = "warning" if event.get("type") == "motion" else "info"
+        metadata = {"score": event.get("score")}
+        # Pushed "add" updates arrive when the event starts, before it has an
+        # end, so only polled events that have finished carry a duration
+        end = event.get("end")
+        if end is not None:
+            metadata["duration"] = end - event.get("start", 0)
+        
+        return UniFiEvent(
+            timestamp=datetime.fromtimestamp(event.get("start", 0) / 1000, tz=timezone.utc).isoformat(),
+            event_type=event.get("type", "camera_event"),
+            source="protect",
+            site_id="default",
+            device_id=event.get("camera"),
+            severity=severity,
+            message=f"Camera event: {event.get('type')} on {event.get('camera_name', 'Unknown Camera')}",
+            metadata=metadata
+        )
+
+    async def _iter_protect_events(self, resp: httpx.Response) -> AsyncIterator[Dict[str, Any]]:
+        """Yield raw Protect events, parsing large bodies incrementally with ijson"""
+        if int(resp.headers.get("Content-Length", 0)) <= PROTECT_STREAM_MIN_BYTES:
+            protect_events = orjson.loads(await resp.aread())
+            if isinstance(protect_events, dict) and "events" in protect_events:
+                protect_events = protect_events["events"]
+            for event in protect_events:
+                yield event
+            return
+        
+        reader = _AsyncByteReader(resp.aiter_bytes())
+        prefix = "item" if await reader.first_byte() == b"[" else "events.item"
+        async for event in ijson.items_async(reader, prefix, use_float=True):
+            yield event
+
     async def get_protect_events(self) -> List[UniFiEvent]:
         """Poll Protect API for camera/motion events"""
         events = []
         try:
-            # Get recent events (last 24h)
+            # Get events that started after the newest one already processed
             end_time = int(datetime.now(timezone.utc).timestamp() * 1000)
-            start_time = end_time - (24 * 60 * 60 * 1000)  # 24h ago
             
-            resp = await self.http_client.get(
+            newest_start = None
+            async with self._conditional_stream(
                 f"{PROTECT_BASE}/events",
-                headers=self.headers,
-                params={"start": start_time, "end": end_time, "limit": 100}
-            )
-            resp.raise_for_status()
-            protect_events = resp.json()
-            
-            if isinstance(protect_events, dict) and "events" in protect_events:
-                protect_events = protect_events["events"]
+                params={"start": self._last_protect_ts, "end": end_time, "limit": 100}
+            ) as resp:
+                if resp is None:  # Not modified since last poll
+                    return events
+                
+                async for event in self._iter_protect_events(resp):
+                    start = event.get("start", 0)
+                    newest_start = start if newest_start is None else max(newest_start, start)
+                    unifi_event = self._protect_event(event)
+                    if unifi_event:
+                        events.append(unifi_event)
             
-            for event in protect_events:
-                event_id = f"protect_{event.get('id')}"
-                if event_id not in self.seen_events:
-                    self.seen_events.add(event_id)
-                    
-                    severity = "warning" if event.get("type") == "motion" else "info"
-                    
-                    events.append(UniFiEvent(
-                        timestamp=datetime.fromtimestamp(event.get("start", 0) / 1000, tz=timezone.utc).isoformat(),
-                        event_type=event.get("type", "camera_event"),
-                        source="protect",
-                        site_id="default",
-                        device_id=event.get("camera"),
-                        severity=severity,
-                        message=f"Camera event: {event.get('type')} on {event.get('camera_name', 'Unknown Camera')}",
-                        metadata={"score": event.get("score"), "duration": event.get("end", 0) - event.get("start", 0)}
-                    ))
+            self._last_protect_ts = max(
+                self._last_protect_ts,
+                end_time if newest_start is None else newest_start + 1
+            )
                     
         except Exception as e:
-            print(f"Error polling protect events: {e}")
+            log.error("Error polling protect events: %s", e)
             
         return events
 
     async def send_to_grafana_annotations(self, events: List[UniFiEvent]):
         """Send events as Grafana annotations"""
         if not GRAFANA_API_KEY:
-            print("No Grafana API key configured, skipping annotations")
+            log.warning("No Grafana API key configured, skipping annotations")
             return
             
         try:
-            grafana_headers = {
-                "Authorization": f"Bearer {GRAFANA_API_KEY}",
-                "Content-Type": "application/json"
-            }
+            # Grafana has no bulk annotations endpoint, so send them concurrently
+            # over the pooled client, bounded so a large batch can't flood it
+            started = time.perf_counter()
+            semaphore = asyncio.Semaphore(ANNOTATION_CONCURRENCY)
             
-            for event in events:
-                annotation = event.to_grafana_annotation()
-                
-                resp = await self.http_client.post(
-                    f"{GRAFANA_URL}/api/annotations",
-                    headers=grafana_headers,
-                    json=annotation
-                )
-                resp.raise_for_status()
-                print(f"✓ Sent annotation: {event.message}")
+            async def post(annotation: Dict[str, Any]) -> httpx.Response:
+                async with semaphore:
+                    return await self.http_client.post(
+                        f"{GRAFANA_URL}/api/annotations",
+                        headers=_GRAFANA_HEADERS,
+                        content=orjson.dumps(annotation)
+                    )
+            
+            annotations = [event.to_grafana_annotation() for event in events]
+            responses = await asyncio.gather(
+                *(post(annotation) for annotation in annotations),
+                return_exceptions=True
+            )
+            sent = failed = 0
+            for annotation, resp in zip(annotations, responses):
+                if isinstance(resp, Exception) or resp.is_error:
+                    failed += 1
+                    log.debug("Failed annotation %s: %s", annotation["text"], resp)
+                else:
+                    sent += 1
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if failed:
+                log.warning("Sent %d annotations in %.1fms (%d failed)", sent, elapsed_ms, failed)
+            else:
+                log.info("✓ Sent %d annotations in %.1fms", sent, elapsed_ms)
                 
         except Exception as e:
-            print(f"Error sending Grafana annotations: {e}")
+            log.error("Error sending Grafana annotations: %s", e)
 
     async def send_to_grafana_mcp(self, events: List[UniFiEvent]):
         """Send events to Grafana MCP server"""
@@ -265,13 +467,14 @@ class UniFiEventStreamer:
             
             resp = await self.http_client.post(
                 f"{GRAFANA_MCP_ENDPOINT}/annotations",
-                json=mcp_payload
+                content=orjson.dumps(mcp_payload),
+                headers={"Content-Type": "application/json"}
             )
             resp.raise_for_status()
-            print(f"✓ Sent {len(events)} events to Grafana MCP")
+            log.info("✓ Sent %d events to Grafana MCP", len(events))
             
         except Exception as e:
-            print(f"Error sending to Grafana MCP: {e}")
+            log.error("Error sending to Grafana MCP: %s", e)
 
     async def push_metrics_to_prometheus(self, events: List[UniFiEvent]):
         """Push metrics to Prometheus pushgateway"""
@@ -279,43 +482,122 @@ class UniFiEventStreamer:
         
         try:
             # Create metrics payload
-            metrics = []
-            for event in events:
-                metrics.append(event.to_prometheus_metric())
+            payload = b"".join(event._prom_bytes() for event in events)
             
-            if metrics:
-                payload = "\n".join(metrics)
-                
+            if payload:
                 resp = await self.http_client.post(
                     f"{prometheus_gateway}/metrics/job/unifi_events",
                     content=payload,
                     headers={"Content-Type": "text/plain"}
                 )
                 resp.raise_for_status()
-                print(f"✓ Pushed {len(metrics)} metrics to Prometheus")
+                log.info("✓ Pushed %d metrics to Prometheus", len(events))
                 
         except Exception as e:
-            print(f"Error pushing to Prometheus: {e}")
+            log.error("Error pushing to Prometheus: %s", e)
 
-    async def poll_and_stream(self):
-        """Main polling loop"""
-        print("🚀 Starting UniFi -> Grafana event streamer...")
-        print(f"→ Polling interval: {EVENT_POLL_INTERVAL}s")
-        print(f"→ UniFi Controller: https://{UNIFI_HOST}:{UNIFI_PORT}")
-        print(f"→ Grafana URL: {GRAFANA_URL}")
-        
+    async def _ws_protect(self):
+        """Consume Protect's updates WebSocket and queue new camera events"""
+        backoff = 1
         while True:
             try:
-                print(f"\n📡 Polling events at {datetime.now()}")
+                async with websockets.connect(
+                    PROTECT_WS_URL,
+                    additional_headers={"X-API-Key": UNIFI_API_KEY},
+                    ssl=_ws_ssl_context()
+                ) as ws:
+                    log.info("✓ Connected to Protect updates WebSocket")
+                    backoff = 1
+                    
+                    # Catch up on events missed while disconnected; anything that
+                    # also arrives on the socket is dropped by the dedup cache
+                    for event in await self.get_protect_events():
+                        await self.event_queue.put(event)
+                    
+                    async for message in ws:
+                        if not isinstance(message, bytes):
+                            continue
+                        # A malformed frame is skipped rather than dropping the connection
+                        try:
+                            action, data = _decode_protect_packet(message)
+                            if not isinstance(action, dict) or not isinstance(data, dict):
+                                continue
+                            if action.get("modelKey") != "event" or action.get("action") != "add":
+                                continue
+                            event = self._protect_event({"id": action.get("id"), **data})
+                        except Exception as e:
+                            log.debug("Skipping malformed Protect update: %s", e)
+                            continue
+                        if event:
+                            # Keep the backfill cursor current so a reconnect only
+                            # re-reads what happened after the last pushed event
+                            self._last_protect_ts = max(self._last_protect_ts, data.get("start", 0) + 1)
+                            await self.event_queue.put(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("Protect WebSocket error, reconnecting in %ds: %s", backoff, e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+    async def _poll_loop(self):
+        """Poll the sources without a push feed and queue new events"""
+        # Access stays polled: its event push lives on the separate developer
+        # API (port 12445, its own bearer token), not the proxied API used here
+        while True:
+            try:
+                log.debug("📡 Polling events")
+                
+                # Collect events from all polled sources
+                pollers = [self.get_network_events(), self.get_access_events()]
+                if not PROTECT_WEBSOCKET:
+                    pollers.append(self.get_protect_events())
+                results = await asyncio.gather(*pollers)
                 
-                # Collect events from all sources
-                all_events = []
-                all_events.extend(await self.get_network_events())
-                all_events.extend(await self.get_access_events())
-                all_events.extend(await self.get_protect_events())
+                polled = [event for events in results for event in events]
+                if not polled:
+                    log.debug("No new events")
+                for event in polled:
+                    self.event_queue.put_nowait(event)
                 
-                if all_events:
-                    print(f"📨 Found {len(all_events)} new events")
+            except Exception as e:
+                log.error("❌ Error in polling loop: %s", e)
+            
+            await asyncio.sleep(EVENT_POLL_INTERVAL)
+
+    async def _next_batch(self) -> List[UniFiEvent]:
+        """Wait for an event, then collect more until the batch is full or stale"""
+        loop = asyncio.get_running_loop()
+        batch = [await self.event_queue.get()]
+        deadline = loop.time() + STREAM_FLUSH_INTERVAL
+        
+        while len(batch) < STREAM_BATCH_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.event_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def poll_and_stream(self):
+        """Main streaming loop"""
+        log.info("🚀 Starting UniFi -> Grafana event streamer...")
+        log.info("→ Polling interval: %ss", EVENT_POLL_INTERVAL)
+        log.info("→ Protect events: %s", "WebSocket push" if PROTECT_WEBSOCKET else "polling")
+        log.info("→ UniFi Controller: https://%s:%s", UNIFI_HOST, UNIFI_PORT)
+        log.info("→ Grafana URL: %s", GRAFANA_URL)
+        
+        producers = [asyncio.create_task(self._poll_loop())]
+        if PROTECT_WEBSOCKET:
+            producers.append(asyncio.create_task(self._ws_protect()))
+        
+        try:
+            while True:
+                try:
+                    all_events = await self._next_batch()
+                    log.info("📨 Found %d new events", len(all_events))
                     
                     # Send to Grafana (choose your method)
                     await self.send_to_grafana_annotations(all_events)
@@ -323,26 +605,42 @@ class UniFiEventStreamer:
                     
                     # Optional: Also push metrics
                     # await self.push_metrics_to_prometheus(all_events)
-                else:
-                    print("No new events")
-                
-                # Cleanup old seen events (prevent memory growth)
-                if len(self.seen_events) > 10000:
-                    # Keep only recent 5000 events
-                    self.seen_events = set(list(self.seen_events)[-5000:])
-                
-                await asyncio.sleep(EVENT_POLL_INTERVAL)
-                
-            except KeyboardInterrupt:
-                print("\n👋 Shutting down streamer...")
-                break
-            except Exception as e:
-                print(f"❌ Error in polling loop: {e}")
-                await asyncio.sleep(EVENT_POLL_INTERVAL)
+                    
+                except KeyboardInterrupt:
+                    log.info("👋 Shutting down streamer...")
+                    break
+                except Exception as e:
+                    log.error("❌ Error in streaming loop: %s", e)
+        finally:
+            for task in producers:
+                task.cancel()
+            await asyncio.gather(*producers, return_exceptions=True)
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Route log records through a queue so handler I/O runs off the event loop"""
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        handlers=[logging.handlers.QueueHandler(log_queue)]
+    )
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
 
 async def main():
     async with UniFiEventStreamer() as streamer:
         await streamer.poll_and_stream()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    listener = setup_logging()
+    try:
+        asyncio.run(main())
+    finally:
+        listener.stop()